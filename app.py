@@ -1,10 +1,21 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, render_template, request, jsonify, session, redirect, Response, stream_with_context
 import json
 from datetime import datetime
 import threading
+import concurrent.futures
 import os
 import time
+import uuid
 import logging
+import logging.handlers
+import queue
+import shutil
+import atexit
+import orjson
+from functools import lru_cache, wraps
+from cachetools import LRUCache
+from redis import Redis
+from rq import Queue, get_current_job
 
 # Import our services
 from services.data_fetcher import MultiSourceDataFetcher
@@ -12,28 +23,169 @@ from services.vector_store import VectorStore
 from services.ai_analyzer import AIAnalyzer
 from services.sentiment_analyzer import SentimentAnalyzer
 from services.rag_bot import RAGBot
+from services.job_store import MemoryJobStore, RedisJobStore, render_status
 from config.settings import Config
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = Config.SECRET_KEY
 
-# Configure basic logging for the application
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s'
-)
+# Configure basic logging for the application. Records are handed to a queue
+# and written by a listener thread, so request and search threads never block
+# on stream I/O.
+log_queue = queue.SimpleQueue()
+
+def add_stage_fields(record: logging.LogRecord) -> bool:
+    """Render the job_id/stage/progress extras of search stage records; empty for others"""
+    record.stage_fields = (f" [job={record.job_id} stage={record.stage} progress={record.progress}%]"
+                           if hasattr(record, 'stage') else '')
+    return True
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s%(stage_fields)s'))
+log_handler.addFilter(add_stage_fields)
+# The queued record only carries the rendered message; log_handler adds the rest
+logging.basicConfig(level=logging.INFO, format='%(message)s', handlers=[logging.handlers.QueueHandler(log_queue)])
 logger = logging.getLogger('msa')
 
-# Global services (in production, use proper dependency injection)
-vector_store = VectorStore()
-data_fetcher = MultiSourceDataFetcher()
-ai_analyzer = AIAnalyzer()
-sentiment_analyzer = SentimentAnalyzer()
-rag_bot = RAGBot(vector_store, ai_analyzer)
+def start_log_listener():
+    """Start the thread draining log_queue into log_handler"""
+    global log_listener
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler, respect_handler_level=True)
+    log_listener.start()
+
+def flush_logs():
+    """Write out every queued record now and keep logging through a new listener"""
+    log_listener.stop()
+    start_log_listener()
+
+start_log_listener()
+atexit.register(lambda: log_listener.stop())
+# Threads do not survive fork (gunicorn --preload), so each worker starts its own
+os.register_at_fork(after_in_child=start_log_listener)
+
+def lazy_service(factory):
+    """Create a service on first use, exactly once even under concurrent requests"""
+    cached = lru_cache(maxsize=1)(factory)
+    lock = threading.Lock()
+
+    @wraps(factory)
+    def get():
+        with lock:
+            return cached()
+    return get
+
+# Global services, created lazily so importing the app (e.g. in an RQ worker or
+# on gunicorn worker restart) does not pay the model loading cost up front
+@lazy_service
+def get_data_fetcher() -> MultiSourceDataFetcher:
+    fetcher = MultiSourceDataFetcher()
+    # Runs before the log listener is stopped, so shutdown messages are still written
+    atexit.register(fetcher.close)
+    return fetcher
+
+@lazy_service
+def get_ai_analyzer() -> AIAnalyzer:
+    return AIAnalyzer()
+
+@lazy_service
+def get_sentiment_analyzer() -> SentimentAnalyzer:
+    return SentimentAnalyzer()
+
+def warm_up_services() -> None:
+    """Create every service now, e.g. in the gunicorn master with --preload"""
+    get_data_fetcher()
+    get_sentiment_analyzer()
+    get_ai_analyzer()
+    VectorStore()  # loads the embedding model shared by every job's store
+
+# Job status and results are keyed by job id. With REDIS_URL set they live in
+# Redis and searches are executed by RQ workers (`rq worker msa`), so every web
+# worker sees the same jobs; otherwise they are kept in this process.
+if Config.REDIS_URL:
+    redis_conn = Redis.from_url(Config.REDIS_URL)
+    job_store = RedisJobStore(redis_conn)
+    task_queue = Queue('msa', connection=redis_conn)
+else:
+    job_store = MemoryJobStore()
+    task_queue = None
+
+# Bounded pool running searches when no task queue is configured; searches
+# beyond MAX_PENDING_SEARCHES (running or waiting) are rejected
+search_executor = concurrent.futures.ThreadPoolExecutor(max_workers=Config.SEARCH_WORKERS,
+                                                        thread_name_prefix='search')
+search_slots = threading.BoundedSemaphore(Config.MAX_PENDING_SEARCHES)
+
+# Each job gets its own vector store and RAG bot, so questions are only ever
+# answered from that job's documents; the most recently used ones stay in memory
+job_bots = LRUCache(maxsize=Config.INDEXED_JOBS)
+index_lock = threading.Lock()
 
-# Global storage for current analysis (in production, use Redis or database)
-current_analysis = {}
-processing_status = {'is_processing': False, 'progress': 0, 'message': 'Ready'}
+def get_job_bot(job_id: str, documents) -> RAGBot:
+    """Get the RAG bot over a job's documents, indexing them if needed"""
+    with index_lock:
+        rag_bot = job_bots.get(job_id)
+    if rag_bot is not None:
+        return rag_bot
+
+    # Built outside the lock so indexing one job does not stall questions on others
+    vector_store = VectorStore()
+    # With VECTOR_STORE_DIR set, a job is embedded once and reloaded from disk afterwards
+    store_dir = os.path.join(Config.VECTOR_STORE_DIR, job_id) if Config.VECTOR_STORE_DIR else None
+    if store_dir is None or not vector_store.load(store_dir):
+        vector_store.add_documents(documents)
+        if store_dir is not None:
+            vector_store.save(store_dir)
+    with index_lock:
+        return job_bots.setdefault(job_id, RAGBot(vector_store, get_ai_analyzer()))
+
+def prune_saved_indexes() -> None:
+    """Delete saved job indexes (and abandoned partial saves) older than RESULT_TTL"""
+    cutoff = time.time() - Config.RESULT_TTL
+    with os.scandir(Config.VECTOR_STORE_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass  # removed by another process meanwhile
+
+def install_index(job_id: str, staged: VectorStore) -> None:
+    """Keep the index built while searching for a job for its questions"""
+    if Config.VECTOR_STORE_DIR:
+        staged.save(os.path.join(Config.VECTOR_STORE_DIR, job_id))
+        # The job's results expire after RESULT_TTL, so its index is no longer needed
+        prune_saved_indexes()
+    # An RQ worker never answers questions; web workers load the saved index
+    if task_queue is None:
+        with index_lock:
+            job_bots[job_id] = RAGBot(staged, get_ai_analyzer())
+
+def get_current_result():
+    """Get the analysis result of the job bound to the current session"""
+    job_id = session.get('job_id')
+    if not job_id:
+        return None
+    return job_store.get_result(job_id)
+
+def get_current_bot():
+    """Get the RAG bot of the job bound to the current session, if it has results"""
+    result = get_current_result()
+    if result is None:
+        return None
+    return get_job_bot(session['job_id'], result['documents'])
+
+def ojson(obj, status: int = 200) -> Response:
+    """JSON response serialized with orjson, which handles dataclasses and datetimes natively"""
+    return Response(orjson.dumps(obj, default=str), status=status, mimetype='application/json')
+
+def event_stream(events) -> Response:
+    """Send an iterable of dicts as server-sent events"""
+    def generate():
+        for event in events:
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/')
 def index():
@@ -47,70 +199,102 @@ def search():
     if not query:
         return render_template('index.html', error="Please enter a search query")
     
-    # Store query in session
+    job_id = uuid.uuid4().hex
+
+    # Serve repeated queries from the query cache without re-running the pipeline
+    cached = job_store.get_cached_result(query)
+    if cached is not None:
+        session['current_query'] = query
+        session['job_id'] = job_id
+        job_store.set_result(job_id, cached)
+        job_store.set_status(job_id, is_processing=False, progress=100, message='Analysis complete',
+                             has_results=True)
+        logger.info("Search submitted: %s (job %s, served from cache)", query, job_id)
+        return render_template('results.html', query=query, processing=True)
+
+    # Apply backpressure when the in-process pool already has enough work
+    if task_queue is None and not search_slots.acquire(blocking=False):
+        logger.warning("Rejecting search for query %s: %d searches already pending",
+                       query, Config.MAX_PENDING_SEARCHES)
+        return render_template('index.html', error="The server is busy, please try again in a moment"), 429
+
+    # Store query and job id in session
     session['current_query'] = query
+    session['job_id'] = job_id
     # Mark processing as queued so the frontend will start polling status immediately
-    processing_status.update({'is_processing': True, 'progress': 0, 'message': 'Queued - starting processing...'})
+    job_store.set_status(job_id, is_processing=True, progress=0, message='Queued - starting processing...',
+                         has_results=False)
 
-    logger.info("Search submitted: %s", query)
-    logger.info("Starting background processing thread for query: %s", query)
+    logger.info("Search submitted: %s (job %s)", query, job_id)
 
-    # Start background processing
-    thread = threading.Thread(target=process_search_async, args=(query,))
-    thread.daemon = True
-    thread.start()
+    if task_queue is not None:
+        # Referenced by name so RQ workers import it from this module
+        task_queue.enqueue('app.process_search_async', query, job_id, job_timeout=Config.JOB_TIMEOUT)
+    else:
+        future = search_executor.submit(process_search_async, query, job_id)
+        future.add_done_callback(lambda _: search_slots.release())
     
     return render_template('results.html', query=query, processing=True)
 
-def process_search_async(query: str):
+def process_search_async(query: str, job_id: str):
     """Process search asynchronously"""
-    global current_analysis, processing_status
-    
+    sentiment_analyzer = get_sentiment_analyzer()
     try:
-        processing_status.update({'is_processing': True, 'progress': 10, 'message': 'Fetching data from sources...'})
-        logger.info("process_search_async started for query: %s", query)
-        logger.info("Status updated: fetching data from sources")
-        
-        # Step 1: Fetch data from all sources
-        documents = data_fetcher.fetch_all_sources(query)
-        processing_status.update({'progress': 40, 'message': 'Processing and storing data...'})
-        logger.info("Fetched %d documents", len(documents))
-        logger.info("Status updated: processing and storing data")
+        job_store.set_status(job_id, is_processing=True, progress=10, message='Fetching and indexing data from sources...')
+        logger.info("Fetching query %s", query,
+                    extra={'job_id': job_id, 'stage': 'fetch', 'progress': 10})
         
-        # Step 2: Clear previous data and add new documents to vector store
-        vector_store.clear()
-        vector_store.add_documents(documents)
-        processing_status.update({'progress': 60, 'message': 'Analyzing sentiment...'})
-        logger.info("Documents added to vector store")
-        logger.info("Status updated: analyzing sentiment")
+        # Steps 1 & 2: Fetch data from all sources, embedding each source's
+        # results while the others are still in flight. The job gets its own
+        # store so concurrent searches never mix documents.
+        staged = VectorStore()
+        documents = get_data_fetcher().fetch_and_index(query, staged)
+        install_index(job_id, staged)
+        job_store.set_status(job_id, progress=40, message='Analyzing sentiment...')
+        logger.info("%d documents fetched", len(documents),
+                    extra={'job_id': job_id, 'stage': 'sentiment', 'progress': 40})
         
         # Step 3: Perform sentiment analysis
         source_analyses = sentiment_analyzer.analyze_documents(documents)
-        processing_status.update({'progress': 80, 'message': 'Generating AI insights...'})
-        logger.info("Sentiment analysis complete for %d source groups", len(source_analyses))
-        logger.info("Status updated: generating AI insights")
+        job_store.set_status(job_id, progress=80, message='Generating AI insights...')
+        logger.info("%d source groups analyzed", len(source_analyses),
+                    extra={'job_id': job_id, 'stage': 'insights', 'progress': 80})
         
         # Step 4: Generate AI analysis
-        analysis = ai_analyzer.generate_analysis(query, documents, source_analyses)
-        processing_status.update({'progress': 90, 'message': 'Finalizing results...'})
-        logger.info("AI analysis generated")
-        logger.info("Status updated: finalizing results")
+        def report_llm_progress(received: int) -> None:
+            # Roughly one fragment per token; avoid a status write for every one
+            if received % 25 == 0:
+                job_store.set_status(job_id, message=f'Generating AI insights... ({received} tokens received)')
+
+        analysis = get_ai_analyzer().generate_analysis(query, documents, source_analyses,
+                                                       on_progress=report_llm_progress)
+        job_store.set_status(job_id, progress=90, message='Finalizing results...')
+        logger.info("Storing results",
+                    extra={'job_id': job_id, 'stage': 'finalize', 'progress': 90})
         
         # Step 5: Store results
-        current_analysis.update({
+        result = {
             'analysis': analysis,
             'documents': documents,
             'source_analyses': source_analyses,
             'sentiment_distribution': sentiment_analyzer.get_overall_sentiment_distribution(source_analyses),
             'timestamp': datetime.now().isoformat()
-        })
-        processing_status.update({'is_processing': False, 'progress': 100, 'message': 'Analysis complete'})
-        logger.info("Analysis complete for query: %s", query)
-        logger.info("Results stored; progress set to 100")
+        }
+        job_store.set_result(job_id, result)
+        # Don't keep serving output degraded by a transient LLM or source API failure
+        if not analysis.used_fallback and not any(doc.metadata.get('placeholder') for doc in documents):
+            job_store.cache_result(query, result)
+        job_store.set_status(job_id, is_processing=False, progress=100, message='Analysis complete', has_results=True)
+        logger.info("Analysis complete for query %s", query,
+                    extra={'job_id': job_id, 'stage': 'complete', 'progress': 100})
         
     except Exception as e:
         logger.exception("Error in async processing for query: %s", query)
-        processing_status.update({'is_processing': False, 'progress': 0, 'message': f'Error: {str(e)}'})
+        job_store.set_status(job_id, is_processing=False, progress=0, message=f'Error: {str(e)}')
+    finally:
+        # RQ work horses exit with os._exit, which skips the atexit flush
+        if get_current_job() is not None:
+            flush_logs()
 
 @app.route('/results')
 def results():
@@ -124,21 +308,30 @@ def results():
 @app.route('/api/status')
 def get_status():
     """Get processing status"""
+    job_id = session.get('job_id')
     # Log status requests at debug level to avoid too much noise
-    logger.debug("Status requested: %s", processing_status)
-    # Include server PID and whether results exist to help debug process mismatches
-    status_copy = processing_status.copy()
-    status_copy['server_pid'] = os.getpid()
-    status_copy['has_results'] = bool(current_analysis)
-    status_copy['last_checked'] = datetime.now().isoformat()
-    return jsonify(status_copy)
+    logger.debug("Status requested for job %s", job_id)
+    # The store keeps each status pre-serialized, refreshed only when it changes
+    body = job_store.get_status_json(job_id) if job_id else None
+    if body is None:
+        # Same shape as a stored status, so clients see one schema
+        body = render_status(job_id, {'is_processing': False, 'progress': 0, 'message': 'Ready',
+                                      'has_results': False, 'last_checked': datetime.now().isoformat()})
+    return Response(body, mimetype='application/json')
+
+@app.route('/api/status/stream')
+def stream_status():
+    """Push processing status updates as server-sent events"""
+    job_id = session.get('job_id')
+    return event_stream(job_store.watch_status(job_id) if job_id else ())
 
 @app.route('/api/results')
 def get_results():
     """Get analysis results"""
+    current_analysis = get_current_result()
     if not current_analysis:
         logger.info("/api/results requested but no analysis available yet (PID=%s)", os.getpid())
-        return jsonify({'error': 'No analysis available', 'server_pid': os.getpid(), 'has_results': False}), 404
+        return ojson({'error': 'No analysis available', 'server_pid': os.getpid(), 'has_results': False}, 404)
     
     # Prepare response data
     analysis = current_analysis['analysis']
@@ -168,30 +361,19 @@ def get_results():
             'sample_content': source_analysis.sample_content
         }
     
-    return jsonify(response_data)
+    return ojson(response_data)
 
 @app.route('/api/documents')
 def get_documents():
     """Get raw documents data"""
+    current_analysis = get_current_result()
     if not current_analysis:
-        return jsonify({'error': 'No documents available'}), 404
+        return ojson({'error': 'No documents available'}, 404)
     
     documents = current_analysis['documents']
-    documents_data = []
-    
-    for doc in documents:
-        documents_data.append({
-            'title': doc.title,
-            'content': doc.content,
-            'url': doc.url,
-            'source_type': doc.source_type,
-            'timestamp': doc.timestamp.isoformat() if doc.timestamp else None,
-            'metadata': doc.metadata
-        })
-    
-    return jsonify({
-        'documents': documents_data,
-        'total': len(documents_data)
+    return ojson({
+        'documents': documents,
+        'total': len(documents)
     })
 
 @app.route('/api/ask', methods=['POST'])
@@ -203,7 +385,8 @@ def ask_question():
     if not question:
         return jsonify({'error': 'Question is required'}), 400
     
-    if not current_analysis:
+    rag_bot = get_current_bot()
+    if rag_bot is None:
         return jsonify({'error': 'No search data available. Please perform a search first.'}), 400
     
     try:
@@ -215,11 +398,56 @@ def ask_question():
         print(f"Error in Q&A: {e}")
         return jsonify({'error': 'Failed to process question'}), 500
 
+@app.route('/api/ask/batch', methods=['POST'])
+def ask_questions_batch():
+    """Answer a list of questions, e.g. to replay a conversation or the suggestions"""
+    data = request.get_json()
+    questions = [str(question).strip() for question in data.get('questions', [])]
+    
+    if not questions or not all(questions):
+        return jsonify({'error': 'A list of non-empty questions is required'}), 400
+    if len(questions) > Config.MAX_BATCH_QUESTIONS:
+        return jsonify({'error': f'At most {Config.MAX_BATCH_QUESTIONS} questions per request'}), 400
+    
+    rag_bot = get_current_bot()
+    if rag_bot is None:
+        return jsonify({'error': 'No search data available. Please perform a search first.'}), 400
+    
+    try:
+        # Embedded and searched together; answered one at a time
+        return jsonify({'answers': rag_bot.ask_batch(questions)})
+        
+    except Exception:
+        logger.exception("Error in batched Q&A for %d questions", len(questions))
+        return jsonify({'error': 'Failed to process questions'}), 500
+
+@app.route('/api/ask/stream')
+def ask_question_stream():
+    """Stream the answer to a question as server-sent events"""
+    question = request.args.get('question', '').strip()
+    
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    
+    rag_bot = get_current_bot()
+    if rag_bot is None:
+        return jsonify({'error': 'No search data available. Please perform a search first.'}), 400
+    
+    def events():
+        try:
+            yield from rag_bot.ask_question_stream(question)
+        except Exception:
+            logger.exception("Error in streamed Q&A for question: %s", question)
+            yield {'type': 'error', 'error': 'Failed to process question'}
+    
+    return event_stream(events())
+
 @app.route('/api/suggestions')
 def get_suggestions():
     """Get suggested questions"""
     query = session.get('current_query', '')
-    if not query:
+    rag_bot = get_current_bot()
+    if not query or rag_bot is None:
         return jsonify({'suggestions': []})
     
     suggestions = rag_bot.get_suggested_questions(query)
@@ -228,7 +456,8 @@ def get_suggestions():
 @app.route('/api/conversation')
 def get_conversation():
     """Get conversation history"""
-    history = rag_bot.get_conversation_history()
+    rag_bot = get_current_bot()
+    history = rag_bot.get_conversation_history() if rag_bot is not None else []
     return jsonify({'conversation': history})
 
 if __name__ == '__main__':
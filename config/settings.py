@@ -14,8 +14,34 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
     MAX_RESULTS_PER_SOURCE = 50
     VECTOR_DB_DIMENSION = 384  # For sentence-transformers/all-MiniLM-L6-v2
+    VECTOR_STORE_DIR = os.getenv('VECTOR_STORE_DIR')  # persist each job's index in a subdirectory
+    INDEXED_JOBS = int(os.getenv('INDEXED_JOBS', 8))  # jobs whose index each web worker keeps in memory
+    TORCH_THREADS = int(os.getenv('TORCH_THREADS', 0))  # CPU encoding threads, 0 keeps torch's default
+    
+    # Job Queue & Result Store (in-process when REDIS_URL is unset)
+    REDIS_URL = os.getenv('REDIS_URL')
+    RESULT_TTL = int(os.getenv('RESULT_TTL', 3600))  # seconds
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 600))  # seconds
+    SEARCH_WORKERS = int(os.getenv('MSA_WORKERS', 4))  # in-process searches run concurrently
+    MAX_PENDING_SEARCHES = int(os.getenv('MSA_MAX_PENDING', 16))  # running + waiting
+    QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 900))  # seconds, 0 disables
+    QUERY_CACHE_SIZE = 256
+    
+    # Sentiment Analysis ('vader', or 'onnx' for an int8 DistilBERT SST-2 model)
+    SENTIMENT_BACKEND = os.getenv('SENTIMENT_BACKEND', 'vader')
+    SENTIMENT_MODEL = 'distilbert-base-uncased-finetuned-sst-2-english'
+    SENTIMENT_MODEL_DIR = os.getenv('SENTIMENT_MODEL_DIR', '.cache/onnx-sentiment')
     
     # LLM Settings
-    LLM_MODEL = "gpt-3.5-turbo"
+    LLM_MODEL = os.getenv('LLM_MODEL', "gpt-3.5-turbo")
+    LLM_BASE_URL = os.getenv('LLM_BASE_URL')  # OpenAI-compatible server, e.g. http://vllm:8000/v1
     MAX_TOKENS = 2000
-    TEMPERATURE = 0.3
\ No newline at end of file
+    TEMPERATURE = 0.3
+    
+    # Q&A Conversation History (oldest exchanges are dropped beyond this)
+    CONVERSATION_HISTORY_SIZE = int(os.getenv('CONVERSATION_HISTORY_SIZE', 200))
+    MAX_BATCH_QUESTIONS = int(os.getenv('MAX_BATCH_QUESTIONS', 20))  # per /api/ask/batch request
+    
+    # Q&A Answer Cache (reused for questions nearly identical to an earlier one)
+    QA_CACHE_SIZE = int(os.getenv('QA_CACHE_SIZE', 256))  # 0 disables
+    QA_CACHE_THRESHOLD = float(os.getenv('QA_CACHE_THRESHOLD', 0.95))  # cosine similarity
\ No newline at end of file
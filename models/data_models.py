@@ -2,7 +2,7 @@ from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
-@dataclass
+@dataclass(slots=True)
 class SearchResult:
     title: str
     content: str
@@ -10,16 +10,15 @@ class SearchResult:
     source_type: str  # 'youtube', 'news', 'twitter'
     timestamp: Optional[datetime] = None
     metadata: Dict[str, Any] = field(default_factory=dict)
-    embedding: Optional[List[float]] = None
     
-@dataclass
+@dataclass(slots=True)
 class SentimentAnalysis:
     positive: float
     negative: float
     neutral: float
     compound: float
     
-@dataclass
+@dataclass(slots=True)
 class SourceAnalysis:
     source_type: str
     total_results: int
@@ -27,10 +26,11 @@ class SourceAnalysis:
     key_themes: List[str]
     sample_content: List[str]
     
-@dataclass
+@dataclass(slots=True)
 class SearchAnalysis:
     query: str
     overall_summary: str
     key_insights: List[str]
     source_analyses: List[SourceAnalysis]
-    timestamp: datetime = field(default_factory=datetime.now)
\ No newline at end of file
+    timestamp: datetime = field(default_factory=datetime.now)
+    used_fallback: bool = False  # summary or insights are the generic text shown when the LLM fails
\ No newline at end of file
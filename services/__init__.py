@@ -7,6 +7,7 @@ This package contains all the core business logic services:
 - ai_analyzer: AI-powered analysis and insights
 - sentiment_analyzer: VADER sentiment analysis
 - rag_bot: RAG-based Q&A system
+- job_store: Job status and result storage (in-process or Redis)
 """
 
 from .data_fetcher import MultiSourceDataFetcher
@@ -14,13 +15,16 @@ from .vector_store import VectorStore
 from .ai_analyzer import AIAnalyzer
 from .sentiment_analyzer import SentimentAnalyzer
 from .rag_bot import RAGBot
+from .job_store import MemoryJobStore, RedisJobStore
 
 __all__ = [
     'MultiSourceDataFetcher',
     'VectorStore', 
     'AIAnalyzer',
     'SentimentAnalyzer',
-    'RAGBot'
+    'RAGBot',
+    'MemoryJobStore',
+    'RedisJobStore'
 ]
 
 # Version information
@@ -1,40 +1,176 @@
-from openai import OpenAI
-from typing import List, Dict
+import json
+import re
+import concurrent.futures
+import httpx
+import tiktoken
+from openai import (OpenAI, OpenAIError, RateLimitError, APIConnectionError,
+                    APITimeoutError, InternalServerError)
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from models.data_models import SearchResult, SearchAnalysis, SourceAnalysis
 from config.settings import Config
 
+# Answer given when the LLM cannot be reached
+UNAVAILABLE_ANSWER = "Unable to process the question '{question}' at the moment."
+
+# Raised while opening a request (OpenAIError) or while reading a streamed
+# response body, which httpx reports directly (e.g. ReadTimeout)
+_LLM_ERRORS = (OpenAIError, httpx.HTTPError)
+
+class AnswerUnavailableError(Exception):
+    """The LLM could not answer a question; str() is the message to show instead"""
+
+# Numbered or bulleted list item, capturing the item text
+_BULLET_RE = re.compile(r'^\s*(?:\d+[.)]?|[-•*])\s+(\S.*)$')
+
+# Shared by every analyzer so TCP/TLS connections are kept alive across calls
+_CLIENT = OpenAI(
+    api_key=Config.OPENAI_API_KEY,
+    base_url=Config.LLM_BASE_URL or None,  # None keeps the OpenAI endpoint
+    timeout=30.0,
+    max_retries=0,  # retries are handled by AIAnalyzer._create_completion
+    http_client=httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+    )
+)
+
 class AIAnalyzer:
     def __init__(self):
         self.config = Config()
-        self.client = OpenAI(api_key=self.config.OPENAI_API_KEY)
+        self.client = _CLIENT
+        self._encoding = None
+
+    @retry(
+        wait=wait_random_exponential(multiplier=1, max=30),
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)),
+        reraise=True
+    )
+    def _create_completion(self, **kwargs):
+        """Create a chat completion, retrying rate limits, timeouts and server errors"""
+        return self.client.chat.completions.create(**kwargs)
+
+    def _stream_completion(self, **kwargs) -> Iterator[str]:
+        """Stream a chat completion, yielding its text fragments as they arrive"""
+        for chunk in self._create_completion(stream=True, **kwargs):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
     def generate_analysis(self, query: str,
                           documents: List[SearchResult],
-                          source_analyses: Dict[str, SourceAnalysis]) -> SearchAnalysis:
+                          source_analyses: Dict[str, SourceAnalysis],
+                          on_progress: Optional[Callable[[int], None]] = None) -> SearchAnalysis:
+        """Generate the summary and insights; on_progress receives the number of
+        response fragments received so far while the answer streams in"""
         context = self._prepare_context(query, documents, source_analyses)
-        summary = self._generate_summary(query, context)
-        insights = self._generate_insights(query, context)
+        summary, insights = self._generate_summary_and_insights(query, context, on_progress)
         return SearchAnalysis(
             query=query,
-            overall_summary=summary,
-            key_insights=insights,
-            source_analyses=list(source_analyses.values())
+            overall_summary=summary or self._generate_fallback_summary(query, context),
+            key_insights=insights or self._generate_fallback_insights(query),
+            source_analyses=list(source_analyses.values()),
+            used_fallback=not summary or not insights
         )
 
     def _prepare_context(self, query, documents, source_analyses) -> str:
         parts = [f"Search Query: {query}", f"Total Documents Analyzed: {len(documents)}", ""]
         for stype, analysis in source_analyses.items():
+            themes = list(dict.fromkeys(analysis.key_themes))[:8]
+            sample = analysis.sample_content[0][:300] if analysis.sample_content else 'N/A'
             parts.extend([
                 f"{stype.upper()} Analysis:",
                 f"- Total results: {analysis.total_results}",
                 f"- Sentiment: Positive: {analysis.sentiment.positive:.2f}, "
                 f"Negative: {analysis.sentiment.negative:.2f}, "
                 f"Neutral: {analysis.sentiment.neutral:.2f}",
-                f"- Key themes: {', '.join(analysis.key_themes)}",
-                f"- Sample content: {analysis.sample_content[0] if analysis.sample_content else 'N/A'}",
+                f"- Key themes: {', '.join(themes)}",
+                f"- Sample content: {sample}",
                 ""
             ])
-        return "\n".join(parts)
+        return self._truncate_to_tokens("\n".join(parts), self.config.MAX_TOKENS * 2)
+
+    def _truncate_to_tokens(self, text: str, max_tokens: int) -> str:
+        """Trim text to at most max_tokens prompt tokens of the configured model"""
+        if self._encoding is None:
+            self._encoding = self._load_encoding()
+        if not self._encoding:
+            # Tokenizer unavailable: assume ~4 characters per token
+            return text[:max_tokens * 4]
+        tokens = self._encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self._encoding.decode(tokens[:max_tokens])
+
+    def _load_encoding(self):
+        """Load the tokenizer of the configured model, or False if unavailable"""
+        try:
+            try:
+                return tiktoken.encoding_for_model(self.config.LLM_MODEL)
+            except KeyError:
+                # Not an OpenAI model name
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Error loading tokenizer: {e}")
+            return False
+
+    def _generate_summary_and_insights(self, query: str, context: str,
+                                       on_progress: Optional[Callable[[int], None]] = None) -> Tuple[str, List[str]]:
+        """Generate the summary and key insights with a single JSON-mode request;
+        either is empty if the LLM could not produce it"""
+        prompt = f"""
+        Based on the following search results for "{query}":
+
+        {context}
+
+        Respond with a JSON object with two keys:
+        - "summary": a comprehensive summary (2–3 paragraphs) covering main topics,
+          sentiment, differences between sources, and notable trends
+        - "insights": a list of 3–5 key insights, each a short string
+        """
+        try:
+            parts = []
+            for fragment in self._stream_completion(
+                model=self.config.LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"},
+                max_tokens=self.config.MAX_TOKENS,
+                temperature=self.config.TEMPERATURE
+            ):
+                parts.append(fragment)
+                if on_progress:
+                    on_progress(len(parts))
+        except _LLM_ERRORS as e:
+            print(f"Error generating analysis: {e}")
+            if parts or isinstance(e, httpx.HTTPError):
+                # The stream broke off mid-response: retry without streaming
+                return self._generate_sections_concurrently(query, context)
+            return "", []
+
+        try:
+            result = json.loads("".join(parts))
+            summary, insights = result["summary"], result["insights"]
+            if isinstance(insights, str):
+                # Local models often return the list as one numbered string
+                insights = [m.group(1) for line in insights.splitlines() if (m := _BULLET_RE.match(line))]
+            if not isinstance(summary, str) or not isinstance(insights, list):
+                raise TypeError("unexpected summary or insights type")
+            summary = summary.strip()
+            insights = [str(insight).strip() for insight in insights if str(insight).strip()]
+            if not summary or not insights:
+                raise ValueError("empty summary or insights")
+            return summary, insights[:5]
+        except (ValueError, KeyError, TypeError) as e:
+            # Malformed JSON: fall back to one request per section
+            print(f"Error parsing analysis response: {e}")
+            return self._generate_sections_concurrently(query, context)
+
+    def _generate_sections_concurrently(self, query: str, context: str) -> Tuple[str, List[str]]:
+        """Run the summary and insights requests concurrently"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            summary_future = executor.submit(self._generate_summary, query, context)
+            insights_future = executor.submit(self._generate_insights, query, context)
+            return summary_future.result(), insights_future.result()
 
     def _generate_summary(self, query: str, context: str) -> str:
         prompt = f"""
@@ -46,16 +182,17 @@ class AIAnalyzer:
         and notable trends. (2–3 paragraphs)
         """
         try:
-            resp = self.client.chat.completions.create(
+            resp = self._create_completion(
                 model=self.config.LLM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=self.config.MAX_TOKENS // 2,
                 temperature=self.config.TEMPERATURE
             )
-            return resp.choices[0].message.content.strip()
-        except Exception as e:
+            # Content is None on e.g. content-filtered responses
+            return (resp.choices[0].message.content or "").strip()
+        except OpenAIError as e:
             print(f"Error generating summary: {e}")
-            return self._generate_fallback_summary(query, context)
+            return ""
 
     def _generate_insights(self, query: str, context: str) -> List[str]:
         prompt = f"""
@@ -66,33 +203,40 @@ class AIAnalyzer:
         Format as a numbered list.
         """
         try:
-            resp = self.client.chat.completions.create(
+            resp = self._create_completion(
                 model=self.config.LLM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=self.config.MAX_TOKENS // 2,
                 temperature=self.config.TEMPERATURE
             )
-            insights_text = resp.choices[0].message.content.strip()
-            insights = []
-            for line in insights_text.splitlines():
-                line = line.strip()
-                if line and (line[0].isdigit() or line.startswith(("-", "•"))):
-                    insight = line.lstrip("0123456789.-• ").strip()
-                    if insight:
-                        insights.append(insight)
-            return insights[:5]
-        except Exception as e:
+            insights_text = resp.choices[0].message.content or ""
+        except OpenAIError as e:
             print(f"Error generating insights: {e}")
-            return self._generate_fallback_insights(query)
+            return []
+        insights = [m.group(1).strip() for line in insights_text.splitlines()
+                    if (m := _BULLET_RE.match(line))]
+        return insights[:5]
 
-    def answer_followup_question(self, question: str,
-                                 relevant_docs: List[SearchResult]) -> str:
+    def _generate_fallback_summary(self, query: str, context: str) -> str:
+        """Summary built from the prepared context when the LLM is unavailable"""
+        return (f"An AI-generated summary is not available right now. "
+                f"Here is an overview of the data collected for \"{query}\":\n\n{context}")
+
+    def _generate_fallback_insights(self, query: str) -> List[str]:
+        """Generic insights used when the LLM is unavailable"""
+        return [
+            f"Results about \"{query}\" were collected from multiple sources",
+            "Compare the sentiment scores of each source to spot differing perspectives",
+            "Use the Q&A panel to explore specific aspects of the topic"
+        ]
+
+    def _followup_prompt(self, question: str, relevant_docs: List[SearchResult]) -> str:
         context_docs = [
             f"Source: {doc.source_type} - {doc.title}\nContent: {doc.content[:300]}..."
             for doc in relevant_docs[:5]
         ]
-        context = "\n\n".join(context_docs)
-        prompt = f"""
+        context = self._truncate_to_tokens("\n\n".join(context_docs), self.config.MAX_TOKENS * 2)
+        return f"""
         Based on the following search results, answer this question: {question}
 
         Context:
@@ -100,14 +244,39 @@ class AIAnalyzer:
 
         Provide a comprehensive answer and cite sources (youtube, news, twitter).
         """
+
+    def answer_followup_question(self, question: str,
+                                 relevant_docs: List[SearchResult]) -> str:
+        """Answer a follow-up question; raises AnswerUnavailableError if the LLM fails"""
+        prompt = self._followup_prompt(question, relevant_docs)
         try:
-            resp = self.client.chat.completions.create(
+            resp = self._create_completion(
                 model=self.config.LLM_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=self.config.MAX_TOKENS // 3,
                 temperature=self.config.TEMPERATURE
             )
-            return resp.choices[0].message.content.strip()
-        except Exception as e:
+            answer = (resp.choices[0].message.content or "").strip()
+        except OpenAIError as e:
+            print(f"Error answering question: {e}")
+            raise AnswerUnavailableError(UNAVAILABLE_ANSWER.format(question=question)) from e
+        if not answer:
+            # No content, e.g. a content-filtered response
+            raise AnswerUnavailableError(UNAVAILABLE_ANSWER.format(question=question))
+        return answer
+
+    def stream_followup_answer(self, question: str,
+                               relevant_docs: List[SearchResult]) -> Iterator[str]:
+        """Yield the answer to a follow-up question as it is generated; raises
+        AnswerUnavailableError if the LLM fails, possibly after some fragments"""
+        prompt = self._followup_prompt(question, relevant_docs)
+        try:
+            yield from self._stream_completion(
+                model=self.config.LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=self.config.MAX_TOKENS // 3,
+                temperature=self.config.TEMPERATURE
+            )
+        except _LLM_ERRORS as e:
             print(f"Error answering question: {e}")
-            return f"Unable to process the question '{question}' at the moment."
+            raise AnswerUnavailableError(UNAVAILABLE_ANSWER.format(question=question)) from e
@@ -1,57 +1,160 @@
-import requests
-import json
-import tweepy
+import aiohttp
+import asyncio
 import concurrent.futures
-from typing import List, Dict, Any
+import json
+import logging
+import orjson
+import os
+import threading
+from tweepy.asynchronous import AsyncClient
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+from typing import List, Dict, Any, Callable, Optional
 from datetime import datetime, timedelta
 from models.data_models import SearchResult
 from config.settings import Config
 
+logger = logging.getLogger('msa.fetcher')
+
+def _is_transient(error: BaseException) -> bool:
+    """Whether a failed API request is worth retrying"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
 class MultiSourceDataFetcher:
     def __init__(self):
         self.config = Config()
         self.setup_twitter_client()
+        # Requests run on one long-lived event loop so the HTTP session and its
+        # connection pool are reused across searches
+        self._loop = None
+        self._loop_pid = None
+        self._loop_lock = threading.Lock()
+        self._session = None
     
     def setup_twitter_client(self):
         """Initialize Twitter API client"""
         try:
-            self.twitter_client = tweepy.Client(
+            self.twitter_client = AsyncClient(
                 bearer_token=self.config.TWITTER_BEARER_TOKEN,
                 wait_on_rate_limit=True
             )
         except Exception as e:
-            print(f"Twitter client setup failed: {e}")
+            logger.warning("Twitter client setup failed: %s", e)
             self.twitter_client = None
     
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Get the fetcher's event loop, starting its thread on first use"""
+        with self._loop_lock:
+            # A forked worker (gunicorn --preload) inherits the loop but not the thread running it
+            if self._loop is None or self._loop_pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                # Requests never leave the loop; its pool only runs the on_results
+                # indexing callbacks (asyncio.to_thread), one per source at most
+                self._loop.set_default_executor(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=3, thread_name_prefix='fetch-index')
+                )
+                self._loop_pid = os.getpid()
+                self._session = None
+                threading.Thread(target=self._run_loop, args=(self._loop,), name='fetcher-loop', daemon=True).start()
+            return self._loop
+    
+    @staticmethod
+    def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+        """Run an event loop until close() stops it"""
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+    
+    def close(self) -> None:
+        """Close the HTTP session and stop the event loop and its worker threads;
+        call explicitly (e.g. at exit), it is not run on garbage collection"""
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+            # Nothing to stop in a forked child: the loop thread belongs to the parent
+            if loop is None or self._loop_pid != os.getpid():
+                return
+            
+            async def shutdown():
+                if self._session is not None:
+                    await self._session.close()
+                    self._session = None
+                await loop.shutdown_default_executor()
+            
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10)
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session; only called from the fetcher's event loop"""
+        if self._session is None:
+            # Keep-alive pool of up to 10 connections per API host
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, limit_per_host=10, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+    
+    @retry(
+        wait=wait_exponential(multiplier=0.3),
+        stop=stop_after_attempt(3),
+        retry=retry_if_exception(_is_transient),
+        reraise=True
+    )
+    async def _get_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """GET a JSON API, retrying connection errors, timeouts, rate limits and server errors"""
+        async with self._get_session().get(url, params=params) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
+    
     def fetch_all_sources(self, query: str) -> List[SearchResult]:
         """Fetch data from all sources in parallel"""
-        results = []
+        return asyncio.run_coroutine_threadsafe(self._afetch_all(query), self._get_loop()).result()
+    
+    def fetch_and_index(self, query: str, vector_store) -> List[SearchResult]:
+        """Fetch data from all sources in parallel, adding each source's results
+        to vector_store as soon as they arrive so embedding overlaps the slower fetches"""
+        return asyncio.run_coroutine_threadsafe(
+            self._afetch_all(query, on_results=vector_store.add_documents), self._get_loop()
+        ).result()
+    
+    async def _afetch_all(self, query: str,
+                          on_results: Optional[Callable[[List[SearchResult]], None]] = None) -> List[SearchResult]:
+        """Fetch data from all sources concurrently on the event loop, passing
+        each source's results to on_results (in a worker thread) as it completes"""
+        fetches = {
+            'YouTube': self.fetch_youtube_videos(query),
+            'News': self.fetch_news_articles(query),
+            'Twitter': self.fetch_twitter_posts(query),
+        }
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            # Submit parallel tasks
-            youtube_future = executor.submit(self.fetch_youtube_videos, query)
-            news_future = executor.submit(self.fetch_news_articles, query)
-            twitter_future = executor.submit(self.fetch_twitter_posts, query)
-            
-            # Collect results
-            try:
-                results.extend(youtube_future.result(timeout=30))
-            except Exception as e:
-                print(f"YouTube fetch error: {e}")
-                
+        async def fetch(source: str, coro) -> tuple:
             try:
-                results.extend(news_future.result(timeout=30))
+                return source, await asyncio.wait_for(coro, timeout=30)
             except Exception as e:
-                print(f"News fetch error: {e}")
-                
-            try:
-                results.extend(twitter_future.result(timeout=30))
-            except Exception as e:
-                print(f"  ==> {e} => Twitter fetch error: ")
+                logger.warning("%s fetch error: %r", source, e)
+                return source, []
+        
+        by_source = {}
+        callbacks = []
+        for completed in asyncio.as_completed([fetch(source, coro) for source, coro in fetches.items()]):
+            source, outcome = await completed
+            by_source[source] = outcome
+            if on_results is not None and outcome:
+                # CPU-bound work such as embedding must not block the event loop
+                callbacks.append(asyncio.create_task(asyncio.to_thread(on_results, outcome)))
+        await asyncio.gather(*callbacks)
+        
+        # Keep the source order stable regardless of which API answered first
+        results = []
+        for source in fetches:
+            results.extend(by_source[source])
         
         return results
     
-    def fetch_youtube_videos(self, query: str) -> List[SearchResult]:
+    async def fetch_youtube_videos(self, query: str) -> List[SearchResult]:
         """Fetch top 5 YouTube videos about the topic"""
         try:
             # YouTube Data API v3
@@ -65,9 +168,7 @@ class MultiSourceDataFetcher:
                 'key': self.config.YOUTUBE_API_KEY
             }
             
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._get_json(url, params)
             
             results = []
             for item in data.get('items', []):
@@ -85,16 +186,14 @@ class MultiSourceDataFetcher:
                 )
                 results.append(result)
                 
-            print(result)   # Debug Print
+            logger.debug("Fetched %d YouTube videos: %s", len(results), results)
             return results
             
-
-
         except Exception as e:
-            print(f"YouTube API error: {e}")
+            logger.warning("YouTube API error: %s", e)
             return self._get_youtube_placeholder_data(query)
     
-    def fetch_news_articles(self, query: str) -> List[SearchResult]:
+    async def fetch_news_articles(self, query: str) -> List[SearchResult]:
         """Fetch top 5 news articles about the topic"""
         try:
             # NewsAPI
@@ -107,9 +206,7 @@ class MultiSourceDataFetcher:
                 'apiKey': self.config.NEWS_API_KEY
             }
             
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
+            data = await self._get_json(url, params)
             
             results = []
             for article in data.get('articles', []):
@@ -126,28 +223,27 @@ class MultiSourceDataFetcher:
                 )
                 results.append(result)
 
-            print(result)   # Debug Print
-            
+            logger.debug("Fetched %d news articles: %s", len(results), results)
             return results
            
         except Exception as e:
-            print(f"News API error: {e}")
+            logger.warning("News API error: %s", e)
             return self._get_news_placeholder_data(query)
     
-    def fetch_twitter_posts(self, query: str) -> List[SearchResult]:
+    async def fetch_twitter_posts(self, query: str) -> List[SearchResult]:
         """Fetch top 5 Twitter posts about the topic"""
         try:
             if not self.twitter_client:
                 return self._get_twitter_placeholder_data(query)
             
-            # Twitter API v2
-            tweets = tweepy.Paginator(
-                self.twitter_client.search_recent_tweets,
+            # Twitter API v2; one page of the minimum size (10) covers the 5 posts needed
+            self.twitter_client.session = self._get_session()
+            response = await self.twitter_client.search_recent_tweets(
                 query=query,
                 tweet_fields=['created_at', 'author_id', 'public_metrics'],
                 max_results=10
-            ).flatten(limit=5)
-            
+            )
+            tweets = (response.data or [])[:5]
             
             results = []
             for tweet in tweets:
@@ -164,12 +260,12 @@ class MultiSourceDataFetcher:
                     }
                 )
                 results.append(result)
-                print(result)   # Debug Print
             
+            logger.debug("Fetched %d tweets: %s", len(results), results)
             return results
             
         except Exception as e:
-            print(f"Twitter API error: {e}")
+            logger.warning("Twitter API error: %s", e)
             return self._get_twitter_placeholder_data(query)
     
     def _get_youtube_placeholder_data(self, query: str) -> List[SearchResult]:
@@ -181,7 +277,7 @@ class MultiSourceDataFetcher:
                 url=f"https://youtube.com/watch?v=placeholder{i+1}",
                 source_type='youtube',
                 timestamp=datetime.now(),
-                metadata={'channel': f'Channel {i+1}', 'video_id': f'placeholder{i+1}'}
+                metadata={'channel': f'Channel {i+1}', 'video_id': f'placeholder{i+1}', 'placeholder': True}
             ) for i in range(5)
         ]
     
@@ -194,7 +290,7 @@ class MultiSourceDataFetcher:
                 url=f"https://example-news-{i+1}.com/article/{query}",
                 source_type='news',
                 timestamp=datetime.now() - timedelta(hours=i),
-                metadata={'source': f'News Source {i+1}', 'author': f'Reporter {i+1}'}
+                metadata={'source': f'News Source {i+1}', 'author': f'Reporter {i+1}', 'placeholder': True}
             ) for i in range(5)
         ]
     
@@ -207,6 +303,7 @@ class MultiSourceDataFetcher:
                 url=f"https://twitter.com/user/status/{1000+i}",
                 source_type='twitter',
                 timestamp=datetime.now() - timedelta(minutes=i*10),
-                metadata={'author_id': f'user_{i+1}', 'retweet_count': i*5, 'like_count': i*10}
+                metadata={'author_id': f'user_{i+1}', 'retweet_count': i*5, 'like_count': i*10,
+                          'placeholder': True}
             ) for i in range(50)
         ]
\ No newline at end of file
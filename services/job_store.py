@@ -0,0 +1,173 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+import orjson
+from cachetools import TTLCache
+from config.settings import Config
+
+def query_cache_key(query: str) -> str:
+    """Cache key of a search query, insensitive to case and surrounding whitespace"""
+    return hashlib.blake2b(query.lower().strip().encode()).hexdigest()
+
+def render_status(job_id: str, status: Dict[str, Any]) -> bytes:
+    """Serialize a job status into the JSON body served by /api/status"""
+    return orjson.dumps({**status, 'job_id': job_id})
+
+class MemoryJobStore:
+    """In-process job store used when no Redis server is configured"""
+
+    def __init__(self, ttl: int = Config.RESULT_TTL, maxsize: int = 1024):
+        self.statuses: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.rendered: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.results: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.query_cache = (TTLCache(maxsize=Config.QUERY_CACHE_SIZE, ttl=Config.QUERY_CACHE_TTL)
+                            if Config.QUERY_CACHE_TTL > 0 else None)
+        self.lock = threading.Lock()
+        self.status_changed = threading.Condition(self.lock)
+
+    def set_status(self, job_id: str, **fields: Any) -> None:
+        """Merge ``fields`` into the status of a job"""
+        with self.lock:
+            status = dict(self.statuses.get(job_id, {}))
+            status.update(fields)
+            status['last_checked'] = datetime.now().isoformat()
+            self.statuses[job_id] = status
+            # Status polls are far more frequent than updates, so serialize once here
+            self.rendered[job_id] = render_status(job_id, status)
+            self.status_changed.notify_all()
+
+    def watch_status(self, job_id: str, timeout: float = Config.JOB_TIMEOUT) -> Iterator[Dict[str, Any]]:
+        """Yield the status of a job each time it changes, until processing ends"""
+        deadline = time.monotonic() + timeout
+        last = None
+        while True:
+            with self.lock:
+                status = self.statuses.get(job_id)
+                while status is last and status is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    self.status_changed.wait(remaining)
+                    status = self.statuses.get(job_id)
+            if status is None:
+                return
+            yield dict(status)
+            if not status.get('is_processing'):
+                return
+            last = status
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of the status of a job"""
+        with self.lock:
+            status = self.statuses.get(job_id)
+            return dict(status) if status is not None else None
+
+    def get_status_json(self, job_id: str) -> Optional[bytes]:
+        """Get the serialized status of a job"""
+        with self.lock:
+            return self.rendered.get(job_id)
+
+    def set_result(self, job_id: str, result: Dict[str, Any]) -> None:
+        """Store the final analysis payload of a job"""
+        with self.lock:
+            self.results[job_id] = result
+
+    def get_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the final analysis payload of a job"""
+        with self.lock:
+            return self.results.get(job_id)
+
+    def cache_result(self, query: str, result: Dict[str, Any]) -> None:
+        """Remember the result of a query for QUERY_CACHE_TTL seconds"""
+        if self.query_cache is None:
+            return
+        with self.lock:
+            self.query_cache[query_cache_key(query)] = result
+
+    def get_cached_result(self, query: str) -> Optional[Dict[str, Any]]:
+        """Get a recent result for the same query, if any"""
+        if self.query_cache is None:
+            return None
+        with self.lock:
+            return self.query_cache.get(query_cache_key(query))
+
+class RedisJobStore:
+    """Job store shared by every web and queue worker through Redis"""
+
+    def __init__(self, connection, ttl: int = Config.RESULT_TTL):
+        self.redis = connection
+        self.ttl = ttl
+
+    def set_status(self, job_id: str, **fields: Any) -> None:
+        """Merge ``fields`` into the status of a job"""
+        key = f"status:{job_id}"
+        fields['last_checked'] = datetime.now().isoformat()
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+        pipe.expire(key, self.ttl)
+        pipe.hgetall(key)
+        raw = pipe.execute()[-1]
+        status = {name.decode(): json.loads(value) for name, value in raw.items()}
+        # Status polls are far more frequent than updates, so serialize once here
+        pipe = self.redis.pipeline()
+        pipe.set(f"status-json:{job_id}", render_status(job_id, status), ex=self.ttl)
+        pipe.publish(f"status-events:{job_id}", 1)
+        pipe.execute()
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the status of a job"""
+        raw = self.redis.hgetall(f"status:{job_id}")
+        if not raw:
+            return None
+        return {name.decode(): json.loads(value) for name, value in raw.items()}
+
+    def get_status_json(self, job_id: str) -> Optional[bytes]:
+        """Get the serialized status of a job"""
+        return self.redis.get(f"status-json:{job_id}")
+
+    def watch_status(self, job_id: str, timeout: float = Config.JOB_TIMEOUT) -> Iterator[Dict[str, Any]]:
+        """Yield the status of a job each time it changes, until processing ends"""
+        deadline = time.monotonic() + timeout
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        # Subscribe before the first read so no update can be missed
+        pubsub.subscribe(f"status-events:{job_id}")
+        try:
+            status = self.get_status(job_id)
+            while status is not None:
+                yield status
+                if not status.get('is_processing'):
+                    return
+                message = None
+                while message is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    message = pubsub.get_message(timeout=remaining)
+                status = self.get_status(job_id)
+        finally:
+            pubsub.close()
+
+    def set_result(self, job_id: str, result: Dict[str, Any]) -> None:
+        """Store the final analysis payload of a job"""
+        self.redis.set(f"result:{job_id}", pickle.dumps(result), ex=self.ttl)
+
+    def get_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the final analysis payload of a job"""
+        raw = self.redis.get(f"result:{job_id}")
+        return pickle.loads(raw) if raw is not None else None
+
+    def cache_result(self, query: str, result: Dict[str, Any]) -> None:
+        """Remember the result of a query for QUERY_CACHE_TTL seconds"""
+        if Config.QUERY_CACHE_TTL > 0:
+            self.redis.setex(f"cache:{query_cache_key(query)}", Config.QUERY_CACHE_TTL, pickle.dumps(result))
+
+    def get_cached_result(self, query: str) -> Optional[Dict[str, Any]]:
+        """Get a recent result for the same query, if any"""
+        if Config.QUERY_CACHE_TTL <= 0:
+            return None
+        raw = self.redis.get(f"cache:{query_cache_key(query)}")
+        return pickle.loads(raw) if raw is not None else None
@@ -1,34 +1,204 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
 from models.data_models import SearchResult
 from services.vector_store import VectorStore
-from services.ai_analyzer import AIAnalyzer
+from services.ai_analyzer import AIAnalyzer, AnswerUnavailableError
+from config.settings import Config
 import threading
+import itertools
+from collections import deque
+
+NO_CONTEXT_ANSWER = "I don't have enough information to answer that question based on the current search results."
+
+# Suggested follow-up questions per available source type, in display order
+SOURCE_SUGGESTIONS = (
+    ('news', ("What do news sources say about {query}?",
+              "What are the latest developments regarding {query}?")),
+    ('twitter', ("What is the public opinion on {query}?",
+                 "How are people reacting to {query} on social media?")),
+    ('youtube', ("Are there any educational videos about {query}?",
+                 "What explanations are available for {query}?")),
+)
+# General analytical questions, suggested for any sources
+GENERAL_SUGGESTIONS = (
+    "What are the main controversies around {query}?",
+    "How has the perception of {query} changed over time?",
+    "What are the different perspectives on {query}?",
+)
 
 class RAGBot:
     def __init__(self, vector_store: VectorStore, ai_analyzer: AIAnalyzer):
         self.vector_store = vector_store
         self.ai_analyzer = ai_analyzer
-        self.conversation_history: List[Dict[str, str]] = []
+        # Oldest exchanges are dropped automatically once the window is full
+        self.conversation_history: deque = deque(maxlen=Config.CONVERSATION_HISTORY_SIZE)
         self.lock = threading.Lock()
+        # Semantic answer cache: row i of _qcache_emb is the question embedding
+        # of _qcache_entries[i], least recently used first
+        self._qcache_emb = np.empty((0, vector_store.dimension), dtype=np.float32)
+        self._qcache_entries: List[Dict[str, Any]] = []
+        self._qcache_version = vector_store.version
     
     def ask_question(self, question: str, context_limit: int = 5) -> Dict[str, Any]:
         """Ask a question and get an answer with sources"""
+        version = self.vector_store.version
+        query_embedding = self.vector_store.embed_query(question)
+        cached = self._get_cached_answer(query_embedding)
+        if cached is not None:
+            self._add_to_history(question, cached['answer'])
+            return dict(cached)
+        
         # Search for relevant documents
-        search_results = self.vector_store.search(question, k=context_limit)
+        search_results = self.vector_store.search_embedding(query_embedding, k=context_limit)
+        return self._answer_from_results(question, query_embedding, search_results, version)
+    
+    def ask_batch(self, questions: List[str], context_limit: int = 5) -> List[Dict[str, Any]]:
+        """Answer several questions, embedding and searching them all in one
+        batch; the answers are still generated one question at a time"""
+        if not questions:
+            return []
+        version = self.vector_store.version
+        query_embeddings = self.vector_store.embed_queries(questions)
+        cached = [self._get_cached_answer(query_embeddings[i:i + 1]) for i in range(len(questions))]
+        
+        # Search for the questions without a cached answer in one FAISS call
+        misses = [i for i, response in enumerate(cached) if response is None]
+        search_results = dict(zip(misses, self.vector_store.search_embeddings(
+            query_embeddings[misses], k=context_limit))) if misses else {}
         
+        responses = []
+        for i, question in enumerate(questions):
+            if cached[i] is not None:
+                self._add_to_history(question, cached[i]['answer'])
+                responses.append(dict(cached[i]))
+            else:
+                responses.append(self._answer_from_results(
+                    question, query_embeddings[i:i + 1], search_results[i], version))
+        return responses
+    
+    def _answer_from_results(self, question: str, query_embedding: np.ndarray,
+                             search_results: List[tuple], version: int) -> Dict[str, Any]:
+        """Generate, record and cache the answer to a question from its search results"""
         if not search_results:
             return {
-                'answer': "I don't have enough information to answer that question based on the current search results.",
+                'answer': NO_CONTEXT_ANSWER,
                 'sources': [],
                 'confidence': 0.0
             }
         
-        # Extract documents and their relevance scores
-        relevant_docs = [result[0] for result in search_results]
-        relevance_scores = [1.0 / (1.0 + result[1]) for result in search_results]  # Convert distance to relevance
+        relevant_docs, sources, confidence = self._prepare_sources(search_results)
         
         # Generate answer using AI analyzer
-        answer = self.ai_analyzer.answer_followup_question(question, relevant_docs)
+        try:
+            answer = self.ai_analyzer.answer_followup_question(question, relevant_docs)
+            failed = False
+        except AnswerUnavailableError as e:
+            answer, failed = str(e), True
+        self._add_to_history(question, answer)
+        
+        response = {
+            'answer': answer,
+            'sources': sources,
+            'confidence': confidence,
+            'total_sources_found': len(sources)
+        }
+        if not failed:
+            self._cache_answer(query_embedding, version, response)
+        return dict(response)
+    
+    def ask_question_stream(self, question: str, context_limit: int = 5) -> Iterator[Dict[str, Any]]:
+        """Ask a question and yield a 'sources' event, 'token' events as the
+        answer is generated, and a final 'done' event with the full answer,
+        or an 'error' event if the answer could not be generated"""
+        version = self.vector_store.version
+        query_embedding = self.vector_store.embed_query(question)
+        cached = self._get_cached_answer(query_embedding)
+        if cached is not None:
+            self._add_to_history(question, cached['answer'])
+            yield {'type': 'sources', 'sources': cached['sources'], 'confidence': cached['confidence'],
+                   'total_sources_found': cached['total_sources_found']}
+            yield {'type': 'token', 'content': cached['answer']}
+            yield {'type': 'done', 'answer': cached['answer']}
+            return
+        
+        search_results = self.vector_store.search_embedding(query_embedding, k=context_limit)
+        
+        if not search_results:
+            yield {'type': 'sources', 'sources': [], 'confidence': 0.0, 'total_sources_found': 0}
+            yield {'type': 'token', 'content': NO_CONTEXT_ANSWER}
+            yield {'type': 'done', 'answer': NO_CONTEXT_ANSWER}
+            return
+        
+        relevant_docs, sources, confidence = self._prepare_sources(search_results)
+        yield {'type': 'sources', 'sources': sources, 'confidence': confidence,
+               'total_sources_found': len(sources)}
+        
+        parts = []
+        try:
+            for fragment in self.ai_analyzer.stream_followup_answer(question, relevant_docs):
+                parts.append(fragment)
+                yield {'type': 'token', 'content': fragment}
+        except AnswerUnavailableError as e:
+            # Don't record or cache the partial answer
+            self._add_to_history(question, str(e))
+            yield {'type': 'error', 'error': str(e)}
+            return
+        
+        answer = "".join(parts).strip()
+        self._add_to_history(question, answer)
+        if answer:
+            self._cache_answer(query_embedding, version, {
+                'answer': answer,
+                'sources': sources,
+                'confidence': confidence,
+                'total_sources_found': len(sources)
+            })
+        yield {'type': 'done', 'answer': answer}
+    
+    def _get_cached_answer(self, query_embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Get the cached response to a near-identical question, if any"""
+        with self.lock:
+            if self._qcache_version != self.vector_store.version:
+                # The documents changed, so earlier answers may no longer hold
+                self._reset_answer_cache()
+                return None
+            if not self._qcache_entries:
+                return None
+            similarities = self._qcache_emb @ query_embedding[0]
+            best = int(similarities.argmax())
+            if similarities[best] < Config.QA_CACHE_THRESHOLD:
+                return None
+            # Mark the entry as most recently used
+            row = self._qcache_emb[best]
+            self._qcache_emb = np.vstack([np.delete(self._qcache_emb, best, axis=0), row])
+            self._qcache_entries.append(self._qcache_entries.pop(best))
+            return self._qcache_entries[-1]
+    
+    def _cache_answer(self, query_embedding: np.ndarray, version: int, response: Dict[str, Any]) -> None:
+        """Cache a response computed against version of the vector store"""
+        if Config.QA_CACHE_SIZE <= 0:
+            return
+        with self.lock:
+            if version != self.vector_store.version:
+                return
+            if self._qcache_version != version:
+                self._reset_answer_cache()
+            # Evict the least recently used entries beyond QA_CACHE_SIZE
+            self._qcache_emb = np.vstack([self._qcache_emb, query_embedding])[-Config.QA_CACHE_SIZE:]
+            self._qcache_entries.append(response)
+            del self._qcache_entries[:-Config.QA_CACHE_SIZE]
+    
+    def _reset_answer_cache(self) -> None:
+        """Drop every cached answer; call with self.lock held"""
+        self._qcache_emb = np.empty((0, self.vector_store.dimension), dtype=np.float32)
+        self._qcache_entries = []
+        self._qcache_version = self.vector_store.version
+    
+    def _prepare_sources(self, search_results: List[tuple]):
+        """Split search results into documents, source descriptions and overall confidence"""
+        # Extract documents and their relevance scores
+        relevant_docs = [result[0] for result in search_results]
+        relevance_scores = [max(0.0, result[1]) for result in search_results]  # Cosine similarity, clipped at 0
         
         # Prepare source information
         sources = []
@@ -43,26 +213,22 @@ class RAGBot:
         
         # Calculate overall confidence based on relevance scores
         avg_confidence = sum(relevance_scores) / len(relevance_scores) if relevance_scores else 0.0
-        
-        # Store in conversation history
+        return relevant_docs, sources, min(avg_confidence, 1.0)  # Cap at 1.0
+    
+    def _add_to_history(self, question: str, answer: str) -> None:
+        """Store an exchange in conversation history"""
         with self.lock:
             self.conversation_history.append({
                 'question': question,
                 'answer': answer,
                 'timestamp': str(threading.current_thread().ident)
             })
-        
-        return {
-            'answer': answer,
-            'sources': sources,
-            'confidence': min(avg_confidence, 1.0),  # Cap at 1.0
-            'total_sources_found': len(sources)
-        }
     
-    def get_conversation_history(self) -> List[Dict[str, str]]:
-        """Get conversation history"""
+    def get_conversation_history(self, n: int = 20) -> List[Dict[str, str]]:
+        """Get the last n exchanges of the conversation history"""
         with self.lock:
-            return self.conversation_history.copy()
+            total = len(self.conversation_history)
+            return list(itertools.islice(self.conversation_history, max(0, total - n), total))
     
     def clear_conversation(self) -> None:
         """Clear conversation history"""
@@ -72,29 +238,11 @@ class RAGBot:
     def get_suggested_questions(self, current_query: str) -> List[str]:
         """Generate suggested follow-up questions"""
         # Get document types available
-        all_docs = self.vector_store.get_all_documents()
-        source_types = set(doc.source_type for doc in all_docs)
-        
-        suggestions = []
-        
-        # Generate contextual suggestions based on available sources
-        if 'news' in source_types:
-            suggestions.append(f"What do news sources say about {current_query}?")
-            suggestions.append(f"What are the latest developments regarding {current_query}?")
-        
-        if 'twitter' in source_types:
-            suggestions.append(f"What is the public opinion on {current_query}?")
-            suggestions.append(f"How are people reacting to {current_query} on social media?")
-        
-        if 'youtube' in source_types:
-            suggestions.append(f"Are there any educational videos about {current_query}?")
-            suggestions.append(f"What explanations are available for {current_query}?")
+        source_types = self.vector_store.source_types()
         
-        # General analytical questions
-        suggestions.extend([
-            f"What are the main controversies around {current_query}?",
-            f"How has the perception of {current_query} changed over time?",
-            f"What are the different perspectives on {current_query}?"
-        ])
+        # Contextual suggestions based on available sources, then general ones
+        templates = [template for source_type, source_templates in SOURCE_SUGGESTIONS
+                     if source_type in source_types for template in source_templates]
+        templates.extend(GENERAL_SUGGESTIONS)
         
-        return suggestions[:6]  # Return top 6 suggestions
\ No newline at end of file
+        return [template.format(query=current_query) for template in templates[:6]]  # Return top 6 suggestions
\ No newline at end of file
@@ -1,11 +1,53 @@
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+import numpy as np
+import os
+import re
+import threading
 from typing import List, Dict
 from models.data_models import SearchResult, SentimentAnalysis, SourceAnalysis
-from collections import defaultdict
+from config.settings import Config
+from collections import Counter, defaultdict
+
+# Candidate theme words: runs of four or more letters
+_WORD_RE = re.compile(r'[a-z]{4,}')
+_STOPWORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'this', 'that', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should'})
+
+_ONNX_CLASSIFIER = None
+_ONNX_LOCK = threading.Lock()
+
+def _get_onnx_classifier():
+    """Load the int8 ONNX sentiment model and its tokenizer once per process,
+    exporting and quantizing it into SENTIMENT_MODEL_DIR on first use"""
+    global _ONNX_CLASSIFIER
+    with _ONNX_LOCK:
+        if _ONNX_CLASSIFIER is None:
+            # Optional dependencies, only needed with SENTIMENT_BACKEND=onnx
+            from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+            
+            model_dir = Config.SENTIMENT_MODEL_DIR
+            if not os.path.exists(os.path.join(model_dir, 'model_quantized.onnx')):
+                model = ORTModelForSequenceClassification.from_pretrained(Config.SENTIMENT_MODEL, export=True)
+                quantizer = ORTQuantizer.from_pretrained(model)
+                quantizer.quantize(save_dir=model_dir,
+                                   quantization_config=AutoQuantizationConfig.avx2(is_static=False))
+                AutoTokenizer.from_pretrained(Config.SENTIMENT_MODEL).save_pretrained(model_dir)
+            _ONNX_CLASSIFIER = (
+                ORTModelForSequenceClassification.from_pretrained(model_dir, file_name='model_quantized.onnx'),
+                AutoTokenizer.from_pretrained(model_dir)
+            )
+        return _ONNX_CLASSIFIER
 
 class SentimentAnalyzer:
     def __init__(self):
         self.analyzer = SentimentIntensityAnalyzer()
+        self.classifier = None
+        if Config.SENTIMENT_BACKEND == 'onnx':
+            try:
+                self.classifier = _get_onnx_classifier()
+            except Exception as e:
+                print(f"ONNX sentiment model unavailable, using VADER: {e}")
     
     def analyze_text(self, text: str) -> SentimentAnalysis:
         """Analyze sentiment of a single text"""
@@ -17,6 +59,33 @@ class SentimentAnalyzer:
             compound=scores['compound']
         )
     
+    def _score_texts(self, texts: List[str]) -> np.ndarray:
+        """Score texts as rows of (positive, negative, neutral, compound)"""
+        if self.classifier is None:
+            return np.array([
+                (scores['pos'], scores['neg'], scores['neu'], scores['compound'])
+                for scores in map(self.analyzer.polarity_scores, texts)
+            ], dtype=np.float64).reshape(-1, 4)
+        
+        model, tokenizer = self.classifier
+        labels = {label.lower(): i for i, label in model.config.id2label.items()}
+        probabilities = []
+        # Batches bound the padding and memory cost of long result lists
+        for start in range(0, len(texts), 64):
+            inputs = tokenizer(texts[start:start + 64], padding=True, truncation=True,
+                               max_length=256, return_tensors='np')
+            logits = np.asarray(model(**inputs).logits, dtype=np.float64)
+            logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities.append(logits / logits.sum(axis=1, keepdims=True))
+        probabilities = np.concatenate(probabilities or [np.empty((0, len(labels)))])
+        
+        # The binary classifier has no neutral class; confident predictions in
+        # either direction leave little neutral mass, like VADER's proportions
+        compound = probabilities[:, labels['positive']] - probabilities[:, labels['negative']]
+        return np.column_stack([
+            np.clip(compound, 0, None), np.clip(-compound, 0, None), 1 - np.abs(compound), compound
+        ])
+    
     def analyze_documents(self, documents: List[SearchResult]) -> Dict[str, SourceAnalysis]:
         """Analyze sentiment for documents grouped by source"""
         source_groups = defaultdict(list)
@@ -28,60 +97,43 @@ class SentimentAnalyzer:
         source_analyses = {}
         
         for source_type, docs in source_groups.items():
-            # Analyze sentiment for each document
-            sentiments = []
-            contents = []
+            # Built once and shared by sentiment scoring and theme extraction
+            combined = [f"{doc.title} {doc.content}" for doc in docs]
             
-            for doc in docs:
-                text = f"{doc.title} {doc.content}"
-                sentiment = self.analyze_text(text)
-                sentiments.append(sentiment)
-                contents.append(doc.content[:200])  # First 200 chars for sample
+            # Analyze sentiment for every document of the source in one batch
+            scores = self._score_texts(combined)
+            contents = [doc.content[:200] for doc in docs[:3]]  # First 200 chars for sample
             
-            # Calculate average sentiment
-            if sentiments:
-                avg_sentiment = SentimentAnalysis(
-                    positive=sum(s.positive for s in sentiments) / len(sentiments),
-                    negative=sum(s.negative for s in sentiments) / len(sentiments),
-                    neutral=sum(s.neutral for s in sentiments) / len(sentiments),
-                    compound=sum(s.compound for s in sentiments) / len(sentiments)
-                )
+            # Calculate average sentiment over the (N, 4) score matrix in one reduction
+            if len(scores):
+                avg_sentiment = SentimentAnalysis(*scores.mean(axis=0).tolist())
             else:
                 avg_sentiment = SentimentAnalysis(0, 0, 1, 0)
             
             # Extract key themes (simplified - in production, use more advanced NLP)
-            key_themes = self._extract_key_themes(docs)
+            key_themes = self._extract_key_themes(combined)
             
             source_analyses[source_type] = SourceAnalysis(
                 source_type=source_type,
                 total_results=len(docs),
                 sentiment=avg_sentiment,
                 key_themes=key_themes,
-                sample_content=contents[:3]  # First 3 samples
+                sample_content=contents  # First 3 samples
             )
         
         return source_analyses
     
-    def _extract_key_themes(self, documents: List[SearchResult]) -> List[str]:
-        """Extract key themes from documents (simplified implementation)"""
+    def _extract_key_themes(self, texts: List[str]) -> List[str]:
+        """Extract key themes from document texts (simplified implementation)"""
         # In a production system, you'd use more sophisticated NLP
         # For now, we'll extract common words (excluding stop words)
         
-        common_words = defaultdict(int)
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'this', 'that', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should'}
-        
-        for doc in documents:
-            text = f"{doc.title} {doc.content}".lower()
-            words = text.split()
-            for word in words:
-                # Clean word
-                clean_word = ''.join(c for c in word if c.isalpha())
-                if len(clean_word) > 3 and clean_word not in stop_words:
-                    common_words[clean_word] += 1
+        # One regex scan over all the text instead of cleaning word by word
+        text = ' '.join(texts).lower()
+        common_words = Counter(word for word in _WORD_RE.findall(text) if word not in _STOPWORDS)
         
         # Return top themes
-        sorted_themes = sorted(common_words.items(), key=lambda x: x[1], reverse=True)
-        return [theme[0] for theme in sorted_themes[:5]]
+        return [theme for theme, _ in common_words.most_common(5)]
     
     def get_overall_sentiment_distribution(self, source_analyses: Dict[str, SourceAnalysis]) -> Dict[str, float]:
         """Get overall sentiment distribution across all sources"""
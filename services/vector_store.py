@@ -1,90 +1,222 @@
 import faiss
 import numpy as np
+import os
 import pickle
+import shutil
+import tempfile
+import torch
 from typing import List, Dict, Any, Optional
 from sentence_transformers import SentenceTransformer
 from models.data_models import SearchResult
-import concurrent.futures
+from config.settings import Config
+from readerwriterlock import rwlock
 import threading
+from collections import Counter
+
+ENCODER_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+_ENCODER: Optional[SentenceTransformer] = None
+_ENCODER_LOCK = threading.Lock()
+
+def _get_encoder() -> SentenceTransformer:
+    """Load the embedding model once per process, in FP16 on a GPU when available"""
+    global _ENCODER
+    with _ENCODER_LOCK:
+        if _ENCODER is None:
+            if torch.cuda.is_available():
+                _ENCODER = SentenceTransformer(ENCODER_MODEL, device='cuda').half()
+            else:
+                # Parallelism comes from torch's intra-op threads, not from concurrent encode calls
+                if Config.TORCH_THREADS > 0:
+                    torch.set_num_threads(Config.TORCH_THREADS)
+                _ENCODER = SentenceTransformer(ENCODER_MODEL, device='cpu')
+        return _ENCODER
 
 class VectorStore:
     def __init__(self, dimension: int = 384):
         self.dimension = dimension
-        self.index = faiss.IndexFlatL2(dimension)
-        self.encoder = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.index = self._new_index()
+        self.encoder = _get_encoder()
         self.documents: List[SearchResult] = []
-        self.lock = threading.Lock()
+        # Row i holds the normalized embedding of self.documents[i]; capacity
+        # doubles as needed so adding documents does not copy the whole matrix
+        self._embeddings = np.empty((0, dimension), dtype=np.float32)
+        # "source_type|url" of every stored document
+        self._seen: set = set()
+        # Number of stored documents per source type
+        self._source_counts: Counter = Counter()
+        # Incremented whenever the stored documents change
+        self.version = 0
+        # FAISS searches are safe to run concurrently; only writers need exclusive access
+        self._rw = rwlock.RWLockFair()
+    
+    @property
+    def embeddings(self) -> np.ndarray:
+        """(N, dimension) float32 view of the stored embeddings"""
+        return self._embeddings[:len(self.documents)]
+    
+    def get_embedding(self, i: int) -> np.ndarray:
+        """View of the embedding of self.documents[i]"""
+        return self.embeddings[i]
+        
+    def _new_index(self) -> faiss.Index:
+        """Create an empty HNSW index; inner product on normalized vectors is cosine similarity"""
+        index = faiss.IndexHNSWFlat(self.dimension, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64
+        return index
         
+    @staticmethod
+    def _document_key(doc: SearchResult) -> str:
+        """Identity of a document for deduplication"""
+        return f"{doc.source_type}|{doc.url}"
+    
     def add_documents(self, documents: List[SearchResult]) -> None:
-        """Add documents to vector store with parallel embedding generation"""
+        """Add documents to vector store with a single batched embedding call"""
+        # Skip documents already stored, being added by a concurrent call, or
+        # repeated within the batch; their keys are reserved before embedding
+        keys = set()
+        with self._rw.gen_wlock():
+            documents = [
+                doc for doc in documents
+                if (key := self._document_key(doc)) not in self._seen and key not in keys and not keys.add(key)
+            ]
+            self._seen.update(keys)
         if not documents:
             return
             
-        # Generate embeddings in parallel
+        # Generate all embeddings in one batched forward pass
         texts = [f"{doc.title} {doc.content}" for doc in documents]
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            # Split texts into chunks for parallel processing
-            chunk_size = max(1, len(texts) // 4)
-            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
-            
-            # Generate embeddings for each chunk
-            embedding_futures = [
-                executor.submit(self.encoder.encode, chunk) 
-                for chunk in chunks
-            ]
-            
-            # Collect results
-            all_embeddings = []
-            for future in concurrent.futures.as_completed(embedding_futures):
-                embeddings = future.result()
-                all_embeddings.extend(embeddings)
-        
-        # Convert to numpy array
-        embeddings_array = np.array(all_embeddings).astype('float32')
+        try:
+            embeddings_array = self.encoder.encode(
+                texts,
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ).astype(np.float32, copy=False)
+        except BaseException:
+            with self._rw.gen_wlock():
+                self._seen.difference_update(keys)
+            raise
+        # Renormalize after the float32 cast (the encoder may run in FP16)
+        faiss.normalize_L2(embeddings_array)
         
         # Thread-safe operations
-        with self.lock:
+        with self._rw.gen_wlock():
             # Add to FAISS index
             self.index.add(embeddings_array)
-            
-            # Store documents with embeddings
-            for doc, embedding in zip(documents, all_embeddings):
-                doc.embedding = embedding.tolist()
-                self.documents.append(doc)
+            start = len(self.documents)
+            end = start + len(embeddings_array)
+            if end > len(self._embeddings):
+                grown = np.empty((max(end, 2 * len(self._embeddings), 64), self.dimension), dtype=np.float32)
+                grown[:start] = self._embeddings[:start]
+                self._embeddings = grown
+            self._embeddings[start:end] = embeddings_array
+            self.documents.extend(documents)
+            self._source_counts.update(doc.source_type for doc in documents)
+            self.version += 1
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Normalized (1, dimension) float32 embedding of a query"""
+        return self.embed_queries([query])
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalized (len(queries), dimension) float32 embeddings, in one batched encode call"""
+        query_embeddings = self.encoder.encode(
+            queries, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+        faiss.normalize_L2(query_embeddings)
+        return query_embeddings
     
     def search(self, query: str, k: int = 5) -> List[tuple]:
-        """Search for similar documents"""
+        """Search for similar documents, scored by cosine similarity"""
         if not self.documents:
             return []
+        return self.search_embedding(self.embed_query(query), k)
+    
+    def search_embedding(self, query_embedding: np.ndarray, k: int = 5) -> List[tuple]:
+        """Search for documents similar to an embedding from embed_query"""
+        return self.search_embeddings(query_embedding, k)[0]
+    
+    def search_embeddings(self, query_embeddings: np.ndarray, k: int = 5) -> List[List[tuple]]:
+        """Search for documents similar to each row of an embedding matrix in one FAISS call"""
+        if not self.documents:
+            return [[] for _ in range(len(query_embeddings))]
             
-        # Generate query embedding
-        query_embedding = self.encoder.encode([query]).astype('float32')
-        
-        # Search in FAISS
-        with self.lock:
-            distances, indices = self.index.search(query_embedding, min(k, len(self.documents)))
-        
-        # Return results with documents and scores
-        results = []
-        for distance, idx in zip(distances[0], indices[0]):
-            if idx < len(self.documents):
-                results.append((self.documents[idx], float(distance)))
-        
-        return results
+        with self._rw.gen_rlock():
+            # Search in FAISS
+            scores, indices = self.index.search(query_embeddings, min(k, len(self.documents)))
+            
+            # Return results with documents and scores; HNSW pads missing hits with -1
+            docs = self.documents
+            n = len(docs)
+            return [
+                [(docs[idx], float(score)) for score, idx in zip(row_scores, row_indices) if 0 <= idx < n]
+                for row_scores, row_indices in zip(scores, indices)
+            ]
     
     def get_all_documents(self) -> List[SearchResult]:
         """Get all stored documents"""
-        with self.lock:
+        with self._rw.gen_rlock():
             return self.documents.copy()
     
     def clear(self) -> None:
         """Clear the vector store"""
-        with self.lock:
-            self.index = faiss.IndexFlatL2(self.dimension)
+        with self._rw.gen_wlock():
+            self.index = self._new_index()
+            self._embeddings = np.empty((0, self.dimension), dtype=np.float32)
             self.documents.clear()
+            self._seen.clear()
+            self._source_counts.clear()
+            self.version += 1
+    
+    def save(self, directory: str) -> None:
+        """Write the index, embeddings and documents to a directory"""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        # Written next to the target and renamed into place, so other processes
+        # only ever see a complete store
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+        try:
+            with self._rw.gen_rlock():
+                faiss.write_index(self.index, os.path.join(staging, 'index.faiss'))
+                np.save(os.path.join(staging, 'emb.npy'), self.embeddings)
+                with open(os.path.join(staging, 'docs.pkl'), 'wb') as f:
+                    pickle.dump(self.documents, f, protocol=5)
+            os.replace(staging, directory)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            # Another process already saved this store
+            if not os.path.isdir(directory):
+                raise
+    
+    def load(self, directory: str) -> bool:
+        """Replace the contents with a store written by save(); False if there is none"""
+        if not os.path.exists(os.path.join(directory, 'docs.pkl')):
+            return False
+        # The HNSW index is read into memory; the embedding matrix is memory-mapped
+        # and paged in on demand
+        index = faiss.read_index(os.path.join(directory, 'index.faiss'))
+        embeddings = np.load(os.path.join(directory, 'emb.npy'), mmap_mode='r')
+        with open(os.path.join(directory, 'docs.pkl'), 'rb') as f:
+            documents = pickle.load(f)
+        with self._rw.gen_wlock():
+            self.index = index
+            # Read-only, but exactly full, so the next add_documents copies it into a new buffer
+            self._embeddings = embeddings
+            self.documents = documents
+            self._seen = {self._document_key(doc) for doc in documents}
+            self._source_counts = Counter(doc.source_type for doc in documents)
+            self.version += 1
+        return True
+    
+    def source_types(self) -> set:
+        """Source types of the stored documents"""
+        with self._rw.gen_rlock():
+            return set(self._source_counts)
     
     def get_documents_by_source(self, source_type: str) -> List[SearchResult]:
         """Get documents filtered by source type"""
-        with self.lock:
+        with self._rw.gen_rlock():
             return [doc for doc in self.documents if doc.source_type == source_type]
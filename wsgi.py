@@ -0,0 +1,20 @@
+"""
+WSGI entrypoint for production deployments
+
+The search pipeline is dominated by network I/O (OpenAI, YouTube, NewsAPI,
+Twitter), so serve it with gevent workers:
+
+    gunicorn -k gevent -w 5 --worker-connections 1000 --preload wsgi:application
+
+Services are created at import so that, with --preload, the embedding model is
+loaded once in the master and shared copy-on-write by the workers. Workers are
+separate processes, so set REDIS_URL to share jobs between them.
+"""
+
+# Patch sockets, threads and blocking calls before anything else imports them
+from gevent import monkey
+monkey.patch_all()
+
+from app import app as application, warm_up_services
+
+warm_up_services()